@@ -9,3 +9,5 @@ pip install scikit-learn==0.24.1
 pip install konlpy==0.5.2
 # faiss install (if you want to)
 pip install faiss-gpu
+# numba install (optional, speeds up reader train feature labeling)
+pip install numba==0.53.1
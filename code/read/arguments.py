@@ -44,7 +44,17 @@ class DataTrainingArguments:
     )
     preprocessing_num_workers: Optional[int] = field(
         default=None,
-        metadata={"help": "The number of processes to use for the preprocessing."},
+        metadata={
+            "help": "The number of processes to use for the preprocessing. "
+            "Ignored by the reader, which tokenizes in a single process with the rust tokenizer's thread pool."
+        },
+    )
+    keep_in_memory: bool = field(
+        default=False,
+        metadata={
+            "help": "Keep the tokenized train features in memory instead of an Arrow cache file. "
+            "Useful for small datasets, but disables reuse of the preprocessing cache."
+        },
     )
     max_seq_length: int = field(
         default=384,
@@ -56,9 +66,8 @@ class DataTrainingArguments:
     pad_to_max_length: bool = field(
         default=False,
         metadata={
-            "help": "Whether to pad all samples to `max_seq_length`. "
-            "If False, will pad the samples dynamically when batching to the maximum length in the batch (which can "
-            "be faster on GPU but will be slower on TPU)."
+            "help": "Deprecated: samples are always padded dynamically by the data collator "
+            "when batching to the maximum length in the batch."
         },
     )
     doc_stride: int = field(
@@ -122,6 +131,13 @@ class TrainerArguments:
     eval_steps: int = field(
         default=500, metadata={"help": "The nuber of steps for evaluation"}
     )
+    group_by_length: bool = field(
+        default=True,
+        metadata={
+            "help": "Whether to group train features of similar length into the same batch "
+            "to reduce padding"
+        },
+    )
     best_model_dir: str = field(
         default="./best_model", metadata={"help": "The directory for best model"}
     )
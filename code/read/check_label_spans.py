@@ -0,0 +1,196 @@
+"""
+train feature label 계산 경로(numba kernel, python kernel, numpy 구현)가 같은 label을 만드는지 확인하는 script.
+random offset과 실제 tokenizer 출력에서 비교하며, 실제 tokenizer 출력은 baseline의 label loop와도 비교합니다.
+"""
+import argparse
+
+import numpy as np
+from datasets import load_from_disk
+from transformers import AutoTokenizer
+
+import mrc_reader
+from label_spans import NUMBA_AVAILABLE, _label_spans, label_spans, label_spans_numpy
+
+
+def get_candidates() -> dict:
+    # 비교할 label 계산 구현들
+    candidates = {"python": _label_spans, "numpy": label_spans_numpy}
+    if NUMBA_AVAILABLE:
+        candidates["numba"] = label_spans
+    return candidates
+
+
+def random_spans(rng, n_spans: int, seq_len: int = 64):
+    # byte-level BPE처럼 여러 token이 같은 offset을 공유하거나, token 사이에 공백이 있는 offset을 만듭니다.
+    offsets = np.zeros((n_spans, seq_len, 2), dtype=np.int32)
+    tok_start = np.zeros(n_spans, dtype=np.int64)
+    tok_end = np.zeros(n_spans, dtype=np.int64)
+    starts = np.full(n_spans, -1, dtype=np.int32)
+    ends = np.zeros(n_spans, dtype=np.int32)
+    for i in range(n_spans):
+        ts = rng.integers(1, 8)
+        te = rng.integers(ts, seq_len - 1)
+        char = rng.integers(0, 50)
+        for k in range(ts, te + 1):
+            if k > ts and rng.random() < 0.4:
+                offsets[i, k] = offsets[i, k - 1]
+                continue
+            char += rng.integers(0, 2)
+            length = rng.integers(1, 4)
+            offsets[i, k] = (char, char + length)
+            char += length
+        tok_start[i], tok_end[i] = ts, te
+        if rng.random() < 0.9:
+            starts[i] = rng.integers(offsets[i, ts, 0] - 2, offsets[i, te, 1] + 2)
+            ends[i] = starts[i] + rng.integers(1, 8)
+    return offsets, tok_start, tok_end, starts, ends
+
+
+def check_random_spans(seed: int, n_spans: int):
+    inputs = random_spans(np.random.default_rng(seed), n_spans)
+    expected_starts, expected_ends = _label_spans(*inputs, 0)
+    for name, label_fn in get_candidates().items():
+        starts, ends = label_fn(*inputs, 0)
+        assert np.array_equal(starts, expected_starts), f"{name} start mismatch"
+        assert np.array_equal(ends, expected_ends), f"{name} end mismatch"
+    print(f"random spans ({n_spans}): {', '.join(get_candidates())} agree")
+
+
+def baseline_labels(tokenizer, examples: dict, answer_column_name: str, **kwargs):
+    # 기존 Reader.prepare_train_features의 token 단위 while loop를 그대로 사용한 label
+    tokenized_examples = tokenizer(
+        examples[kwargs["first_column_name"]],
+        examples[kwargs["second_column_name"]],
+        truncation=kwargs["truncation"],
+        max_length=kwargs["max_seq_length"],
+        stride=kwargs["doc_stride"],
+        return_overflowing_tokens=True,
+        return_offsets_mapping=True,
+        padding=False,
+    )
+    sample_mapping = tokenized_examples["overflow_to_sample_mapping"]
+    context_index = kwargs["context_index"]
+    start_positions, end_positions = [], []
+    for i, offsets in enumerate(tokenized_examples["offset_mapping"]):
+        input_ids = tokenized_examples["input_ids"][i]
+        cls_index = input_ids.index(tokenizer.cls_token_id)
+        sequence_ids = tokenized_examples.sequence_ids(i)
+        answers = examples[answer_column_name][sample_mapping[i]]
+
+        if len(answers["answer_start"]) == 0:
+            start_positions.append(cls_index)
+            end_positions.append(cls_index)
+            continue
+        start_char = answers["answer_start"][0]
+        end_char = start_char + len(answers["text"][0])
+
+        token_start_index = 0
+        while sequence_ids[token_start_index] != context_index:
+            token_start_index += 1
+        token_end_index = len(input_ids) - 1
+        while sequence_ids[token_end_index] != context_index:
+            token_end_index -= 1
+
+        if not (
+            offsets[token_start_index][0] <= start_char
+            and offsets[token_end_index][1] >= end_char
+        ):
+            start_positions.append(cls_index)
+            end_positions.append(cls_index)
+        else:
+            while (
+                token_start_index < len(offsets)
+                and offsets[token_start_index][0] <= start_char
+            ):
+                token_start_index += 1
+            start_positions.append(token_start_index - 1)
+            while offsets[token_end_index][1] >= end_char:
+                token_end_index -= 1
+            end_positions.append(token_end_index + 1)
+    return np.array(start_positions), np.array(end_positions)
+
+
+def check_tokenizer_output(args):
+    tokenizer = AutoTokenizer.from_pretrained(args.model_name_or_path, use_fast=True)
+    dataset = load_from_disk(args.dataset_name)["train"]
+    if args.num_examples is not None:
+        dataset = dataset.select(range(min(args.num_examples, len(dataset))))
+    examples = dataset[:]
+
+    # Reader.set_column_name과 같은 방식으로 padding side에 맞춰 순서를 정합니다.
+    if tokenizer.padding_side == "right":
+        column_kwargs = {
+            "first_column_name": "question",
+            "second_column_name": "context",
+            "truncation": "only_second",
+            "context_index": 1,
+        }
+    else:
+        column_kwargs = {
+            "first_column_name": "context",
+            "second_column_name": "question",
+            "truncation": "only_first",
+            "context_index": 0,
+        }
+    tokenize_kwargs = {
+        **column_kwargs,
+        "max_seq_length": args.max_seq_length,
+        "doc_stride": args.doc_stride,
+    }
+
+    baseline_starts, baseline_ends = baseline_labels(
+        tokenizer, examples, "answers", **tokenize_kwargs
+    )
+    # baseline loop는 정답이 context 마지막 token에서 시작하는 경우 등에서 start > end인 label을 만들므로
+    # 해당 span은 baseline과의 비교에서 제외합니다.
+    valid = baseline_starts <= baseline_ends
+
+    labels = {}
+    for name, label_fn in get_candidates().items():
+        # prepare_train_features가 사용하는 label 계산 구현을 바꿔가며 실행합니다.
+        mrc_reader.label_spans = label_fn
+        tokenized_examples = mrc_reader.prepare_train_features(
+            examples,
+            tokenizer,
+            context_column_name="context",
+            answer_column_name="answers",
+            **tokenize_kwargs,
+        )
+        starts = np.array(tokenized_examples["start_positions"])
+        ends = np.array(tokenized_examples["end_positions"])
+        labels[name] = (starts, ends)
+
+        mismatch = valid & ((starts != baseline_starts) | (ends != baseline_ends))
+        print(
+            f"{name}: {len(starts)} spans, {int(mismatch.sum())} differ from baseline "
+            f"({int((~valid).sum())} spans with baseline start > end skipped)"
+        )
+        assert not mismatch.any(), f"{name} differs from baseline"
+    mrc_reader.label_spans = label_spans
+
+    expected_starts, expected_ends = labels["python"]
+    for name, (starts, ends) in labels.items():
+        assert np.array_equal(starts, expected_starts), f"{name} start mismatch"
+        assert np.array_equal(ends, expected_ends), f"{name} end mismatch"
+    print(f"tokenizer output: {', '.join(labels)} agree")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="")
+    parser.add_argument(
+        "--dataset_name", default="../../data/train_dataset", type=str, help=""
+    )
+    parser.add_argument(
+        "--model_name_or_path", default="klue/bert-base", type=str, help=""
+    )
+    parser.add_argument("--max_seq_length", default=384, type=int, help="")
+    parser.add_argument("--doc_stride", default=128, type=int, help="")
+    parser.add_argument(
+        "--num_examples", default=None, type=int, help="check only the first N examples"
+    )
+    parser.add_argument("--num_random_spans", default=2000, type=int, help="")
+    parser.add_argument("--random_seed", default=42, type=int, help="")
+    args = parser.parse_args()
+
+    check_random_spans(args.random_seed, args.num_random_spans)
+    check_tokenizer_output(args)
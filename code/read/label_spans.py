@@ -0,0 +1,94 @@
+"""
+train feature의 start/end position label을 numba로 한 번에 계산하는 kernel.
+numba가 설치되어 있지 않으면 NUMBA_AVAILABLE이 False가 되며, label_spans는 같은 탐색 규칙의 numpy 구현을 사용합니다.
+"""
+import numpy as np
+
+try:
+    from numba import njit
+
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+
+def _label_spans(offsets, tok_start, tok_end, starts, ends, cls_index):
+    """
+    span마다 정답의 Start/End token index를 찾습니다.
+
+    Args:
+        offsets (:obj:`np.ndarray`): (n_spans, seq_len, 2) token의 character offset
+        tok_start (:obj:`np.ndarray`): (n_spans,) span의 context Start token index
+        tok_end (:obj:`np.ndarray`): (n_spans,) span의 context End token index
+        starts (:obj:`np.ndarray`): (n_spans,) 정답의 Start character index, 정답이 없으면 -1
+        ends (:obj:`np.ndarray`): (n_spans,) 정답의 End character index
+        cls_index (:obj:`int`): 정답이 없거나 span을 벗어난 경우의 label
+    """
+    n_spans = offsets.shape[0]
+    start_positions = np.full(n_spans, cls_index, dtype=np.int64)
+    end_positions = np.full(n_spans, cls_index, dtype=np.int64)
+    for i in range(n_spans):
+        start_char = starts[i]
+        end_char = ends[i]
+        ts = tok_start[i]
+        te = tok_end[i]
+        # answer가 없거나 정답이 span을 벗어난 경우 cls_index를 그대로 둡니다.
+        if start_char < 0:
+            continue
+        if not (offsets[i, ts, 0] <= start_char and offsets[i, te, 1] >= end_char):
+            continue
+
+        # context 구간의 offset은 정렬되어 있으므로 이진 탐색으로 찾습니다.
+        # Start: offset 시작이 start_char 이하인 마지막 token
+        lo = ts
+        hi = te + 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if offsets[i, mid, 0] <= start_char:
+                lo = mid + 1
+            else:
+                hi = mid
+        start_positions[i] = lo - 1
+
+        # End: offset 끝이 end_char 이상인 첫 token
+        lo = ts
+        hi = te + 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if offsets[i, mid, 1] < end_char:
+                lo = mid + 1
+            else:
+                hi = mid
+        end_positions[i] = lo
+    return start_positions, end_positions
+
+
+def label_spans_numpy(offsets, tok_start, tok_end, starts, ends, cls_index):
+    """
+    numba가 없을 때 사용하는 _label_spans의 numpy 구현입니다. 인자와 탐색 규칙이 같습니다.
+    span마다 자신의 context 구간 offset에서 searchsorted로 Start/End token을 찾습니다.
+    """
+    n_spans = offsets.shape[0]
+    start_positions = np.full(n_spans, cls_index, dtype=np.int64)
+    end_positions = np.full(n_spans, cls_index, dtype=np.int64)
+    for i in np.flatnonzero(starts >= 0):
+        start_char = starts[i]
+        end_char = ends[i]
+        ts = tok_start[i]
+        te = tok_end[i]
+        off = offsets[i, ts : te + 1]
+        # 정답이 span을 벗어난 경우 cls_index를 그대로 둡니다.
+        if not (off[0, 0] <= start_char and off[-1, 1] >= end_char):
+            continue
+        start_positions[i] = ts + np.searchsorted(off[:, 0], start_char, "right") - 1
+        end_positions[i] = ts + np.searchsorted(off[:, 1], end_char, "left")
+    return start_positions, end_positions
+
+
+# prepare_train_features_sharded가 여러 thread에서 동시에 호출하므로 parallel=True 대신
+# GIL을 해제(nogil)해서 thread 단위로 병렬 실행되도록 합니다(workqueue threading layer는 thread-safe하지 않습니다).
+if NUMBA_AVAILABLE:
+    label_spans = njit(nogil=True, cache=True)(_label_spans)
+else:
+    label_spans = label_spans_numpy
+
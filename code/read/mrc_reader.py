@@ -1,3 +1,8 @@
+import os
+
+# .map을 단일 process로 실행하므로 rust tokenizer가 내부 thread pool을 사용하도록 합니다.
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "true")
+
 from transformers import (
     AutoConfig,
     AutoModelForQuestionAnswering,
@@ -6,15 +11,243 @@ from transformers import (
     DataCollatorWithPadding,
 )
 from utils_qa import postprocess_qa_predictions
-from importlib import import_module
-import sys
 from arguments import (
     ModelArguments,
     DataTrainingArguments,
 )
+from models import custom1, custom2, custom3
+from label_spans import label_spans
 from typing import List, Callable, NoReturn, NewType, Any
 import dataclasses
-from datasets import load_metric, Dataset, DatasetDict
+import copy
+import functools
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from datasets import load_metric, Dataset, DatasetDict, Features, Sequence, Value
+
+
+def get_sequence_ids(tokenized_examples) -> np.ndarray:
+    # batch 전체의 sequence id를 한 번에 (n_spans, seq_len) int8 배열로 만듭니다.
+    # None(special token)과 batch 내 최대 길이까지의 빈 자리는 -1로 채웁니다.
+    encodings = tokenized_examples.encodings
+    seq_len = max(len(encoding.sequence_ids) for encoding in encodings)
+    seq_ids_all = np.full((len(encodings), seq_len), -1, dtype=np.int8)
+    for i, encoding in enumerate(encodings):
+        sequence_ids = encoding.sequence_ids
+        seq_ids_all[i, : len(sequence_ids)] = [
+            -1 if s is None else s for s in sequence_ids
+        ]
+    return seq_ids_all
+
+
+# 같은 process에서 Reader를 여러 번 만들 때 hub cache 조회와 json/vocab parsing을 반복하지 않도록
+# 불러온 config/tokenizer를 이름별로 보관합니다. cache에 있는 객체를 그대로 반환하므로,
+# 호출하는 쪽(Reader.set_model_and_tokenizer)에서 복사해서 사용합니다.
+# model weight는 크기가 크므로 cache하지 않고 Reader마다 새로 불러옵니다.
+@functools.lru_cache(maxsize=8)
+def _cached_config(name: str) -> AutoConfig:
+    return AutoConfig.from_pretrained(name)
+
+
+@functools.lru_cache(maxsize=8)
+def _cached_tokenizer(name: str) -> AutoTokenizer:
+    # 'use_fast' argument를 True로 설정할 경우 rust로 구현된 tokenizer를 사용할 수 있습니다.
+    # False로 설정할 경우 python으로 구현된 tokenizer를 사용할 수 있으며,
+    # rust version이 비교적 속도가 빠릅니다.
+    return AutoTokenizer.from_pretrained(name, use_fast=True)
+
+
+def add_length_columns(
+    examples: Dataset,
+    indices: List[int],
+    question_column_name: str,
+    context_column_name: str,
+):
+    # 원래 example index와 (question + context) 길이를 column으로 추가합니다.
+    return {
+        "_orig_idx": indices,
+        "context_len": [
+            len(q) + len(c)
+            for q, c in zip(
+                examples[question_column_name], examples[context_column_name]
+            )
+        ],
+    }
+
+
+# feature 생성 함수는 Reader 밖에 두어 datasets map의 fingerprint가 Reader의 다른 attribute(params 등)에
+# 영향을 받지 않도록 합니다. 필요한 값만 functools.partial로 넘겨 cache를 최대한 재사용합니다.
+def prepare_train_features(
+    examples: Dataset,
+    tokenizer: AutoTokenizer,
+    first_column_name: str,
+    second_column_name: str,
+    truncation: str,
+    context_index: int,
+    context_column_name: str,
+    answer_column_name: str,
+    max_seq_length: int,
+    doc_stride: int,
+):
+    # Train preprocessing / 전처리를 진행하는 함수.
+    # truncation을 통해 toknization을 진행하며, stride를 이용하여 overflow를 유지합니다.
+    # 각 example들은 이전의 context와 조금씩 겹치게됩니다.
+    # (question|context) 혹은 (context|question) 순서와 truncation 방향은 Reader에서 padding side에 맞춰 정해서 넘겨줍니다.
+    # text에서 정답의 Start/end character index를 example마다 미리 배열로 꺼내둡니다.
+    # answer가 없는 example은 start/end를 -1로 표시합니다(== example에서 정답이 없는 경우 존재할 수 있음).
+    answer_starts = np.array(
+        [
+            a["answer_start"][0] if a["answer_start"] else -1
+            for a in examples[answer_column_name]
+        ],
+        dtype=np.int32,
+    )
+    answer_ends = answer_starts + np.array(
+        [
+            len(a["text"][0]) if a["answer_start"] else 0
+            for a in examples[answer_column_name]
+        ],
+        dtype=np.int32,
+    )
+
+    tokenized_examples = tokenizer(
+        examples[first_column_name],
+        examples[second_column_name],
+        truncation=truncation,
+        max_length=max_seq_length,
+        stride=doc_stride,
+        return_overflowing_tokens=True,
+        # offset mapping은 정답이 있는 span에서만 encoding으로부터 직접 읽으므로 변환하지 않습니다.
+        return_offsets_mapping=False,
+        # padding 전의 attention mask는 모두 1이므로 저장하지 않고 data collator가 padding하면서 만듭니다.
+        return_attention_mask=False,
+        # return_token_type_ids=False, # roberta모델을 사용할 경우 False, bert를 사용할 경우 True로 표기해야합니다.
+        # padding은 data collator에서 batch 단위로 진행합니다.
+        padding=False,
+    )
+
+    # 길이가 긴 context가 등장할 경우 truncate를 진행해야하므로, 해당 데이터셋을 찾을 수 있도록 mapping 가능한 값이 필요합니다.
+    sample_mapping = tokenized_examples.pop("overflow_to_sample_mapping")
+    # token의 캐릭터 단위 position를 찾을 수 있도록 encoding의 offset을 사용합니다.
+    # start_positions과 end_positions을 찾는데 도움을 줄 수 있습니다.
+    encodings = tokenized_examples.encodings
+
+    # 정렬 전 순서로 되돌릴 수 있도록 각 span에 원래 example index를 기록합니다.
+    if "_orig_idx" in examples:
+        tokenized_examples["_orig_idx"] = [
+            examples["_orig_idx"][s] for s in sample_mapping
+        ]
+
+    # 데이터셋에 "start position", "enc position" label을 부여합니다.
+    # sequence id를 (n_spans, seq_len) 배열로 쌓아 context 구간을 한 번에 계산합니다.
+    n_spans = len(encodings)
+    mask = get_sequence_ids(tokenized_examples) == context_index
+    seq_len = mask.shape[1]
+
+    # text에서 current span의 context Start/End token index
+    tok_start = mask.argmax(axis=1)
+    tok_end = (seq_len - 1) - mask[:, ::-1].argmax(axis=1)
+
+    # answer가 없거나 정답이 span을 벗어난 경우 cls_index를 answer로 설정합니다.
+    # cls token은 항상 0번째에 위치합니다(Reader.check_cls_position에서 확인).
+    # 정답이 있는 span의 offset만 (n_spans, seq_len, 2) 배열로 쌓아 label을 한 번에 계산합니다.
+    # label_spans는 numba가 있으면 kernel, 없으면 같은 탐색 규칙의 numpy 구현입니다.
+    span_starts = answer_starts[sample_mapping]
+    span_ends = answer_ends[sample_mapping]
+    offsets = np.zeros((n_spans, seq_len, 2), dtype=np.int32)
+    for i in np.flatnonzero(span_starts >= 0):
+        span_offsets = encodings[i].offsets
+        offsets[i, : len(span_offsets)] = span_offsets
+    start_positions, end_positions = label_spans(
+        offsets, tok_start, tok_end, span_starts, span_ends, 0
+    )
+
+    tokenized_examples["start_positions"] = start_positions.tolist()
+    tokenized_examples["end_positions"] = end_positions.tolist()
+
+    return tokenized_examples
+
+
+def prepare_train_features_sharded(
+    examples: Dataset, tokenizer_pool: List[AutoTokenizer], **kwargs
+):
+    # batch를 tokenizer pool 크기만큼 나눠 thread마다 다른 tokenizer로 feature를 생성한 뒤 이어붙입니다.
+    # rust tokenizer는 encode 중 GIL을 해제하므로 thread만으로 병렬 처리가 됩니다.
+    # kwargs는 prepare_train_features에 그대로 전달됩니다.
+    num_examples = len(examples[kwargs["first_column_name"]])
+    shard_size = -(-num_examples // len(tokenizer_pool))
+    shards = [
+        {key: values[start : start + shard_size] for key, values in examples.items()}
+        for start in range(0, num_examples, shard_size)
+    ]
+    prepare_shard = functools.partial(prepare_train_features, **kwargs)
+    with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+        results = list(executor.map(prepare_shard, shards, tokenizer_pool))
+
+    tokenized_examples = {key: [] for key in results[0].keys()}
+    for result in results:
+        for key in tokenized_examples:
+            tokenized_examples[key].extend(result[key])
+    return tokenized_examples
+
+
+def prepare_validation_features(
+    examples: Dataset,
+    tokenizer: AutoTokenizer,
+    first_column_name: str,
+    second_column_name: str,
+    truncation: str,
+    context_index: int,
+    max_seq_length: int,
+    doc_stride: int,
+):
+    # truncation을 통해 toknization을 진행하며, stride를 이용하여 overflow를 유지합니다.
+    # 각 example들은 이전의 context와 조금씩 겹치게됩니다.
+    tokenized_examples = tokenizer(
+        examples[first_column_name],
+        examples[second_column_name],
+        truncation=truncation,
+        max_length=max_seq_length,
+        stride=doc_stride,
+        return_overflowing_tokens=True,
+        # offset mapping은 아래에서 encoding으로부터 직접 읽어 한 번에 처리하므로 변환하지 않습니다.
+        return_offsets_mapping=False,
+        # return_token_type_ids=False, # roberta모델을 사용할 경우 False, bert를 사용할 경우 True로 표기해야합니다.
+        # padding은 data collator에서 batch 단위로 진행합니다.
+        padding=False,
+    )
+
+    # 길이가 긴 context가 등장할 경우 truncate를 진행해야하므로, 해당 데이터셋을 찾을 수 있도록 mapping 가능한 값이 필요합니다.
+    sample_mapping = tokenized_examples.pop("overflow_to_sample_mapping")
+    encodings = tokenized_examples.encodings
+
+    # 정렬 전 순서로 되돌릴 수 있도록 각 span에 원래 example index를 기록합니다.
+    if "_orig_idx" in examples:
+        tokenized_examples["_orig_idx"] = [
+            examples["_orig_idx"][s] for s in sample_mapping
+        ]
+
+    # evaluation을 위해, prediction을 context의 substring으로 변환해야합니다.
+    # corresponding example_id를 유지하고 offset mappings을 저장해야합니다.
+    # 하나의 example이 여러개의 span을 가질 수 있습니다.
+    all_ids = examples["id"]
+    tokenized_examples["example_id"] = [all_ids[s] for s in sample_mapping]
+
+    # sequence id를 설정합니다 (to know what is the context and what is the question).
+    context_mask = get_sequence_ids(tokenized_examples) == context_index
+
+    # offset을 (n_spans, seq_len, 2) 배열로 쌓은 뒤 context가 아닌 token의 offset을 (-1, -1)로 설정해서
+    # token position이 context의 일부인지 쉽게 판별 할 수 있습니다(postprocess_qa_predictions 참고).
+    lengths = [len(encoding.offsets) for encoding in encodings]
+    offset_mapping = np.zeros(context_mask.shape + (2,), dtype=np.int32)
+    for i, encoding in enumerate(encodings):
+        offset_mapping[i, : lengths[i]] = encoding.offsets
+    offset_mapping[~context_mask] = -1
+    tokenized_examples["offset_mapping"] = [
+        offset_mapping[i, :length].tolist() for i, length in enumerate(lengths)
+    ]
+
+    return tokenized_examples
 
 
 class Reader:
@@ -43,8 +276,14 @@ class Reader:
         The method for getting model and tokenizer
     """
 
-    get_custom_class = {"custom1": "CustomRobertaLarge",
-                        "custom2": "CustomRobertaLarge", "custom3": "CustomRobertaLarge", }
+    get_custom_class = {
+        "custom1": custom1.CustomRobertaLarge,
+        "custom2": custom2.CustomRobertaLarge,
+        "custom3": custom3.CustomRobertaLarge,
+    }
+
+    # train feature 생성 시 batch를 나눠 처리할 tokenizer 복사본의 개수
+    tokenizer_pool_size = 4
 
     def __init__(
         self,
@@ -67,36 +306,39 @@ class Reader:
     def set_model_and_tokenizer(self) -> NoReturn:
         # Issue : # klue/bert-base, pre_klue/bert-base -> naming convention이 불편하다
         if self.classifier == "pre":
-            model_config = AutoConfig.from_pretrained(
-                self.config_name if self.config_name is not None else self.model_name,
-            )
-            model_tokenizer = AutoTokenizer.from_pretrained(
+            model_tokenizer = _cached_tokenizer(
                 self.tokenizer_name
                 if self.tokenizer_name is not None
                 else self.model_name,
-                # 'use_fast' argument를 True로 설정할 경우 rust로 구현된 tokenizer를 사용할 수 있습니다.
-                # False로 설정할 경우 python으로 구현된 tokenizer를 사용할 수 있으며,
-                # rust version이 비교적 속도가 빠릅니다.
-                use_fast=True,
             )
-            model = AutoModelForQuestionAnswering.from_pretrained(
+            model_config = _cached_config(
+                self.config_name if self.config_name is not None else self.model_name,
+            )
+            self.model = AutoModelForQuestionAnswering.from_pretrained(
                 self.model_name,
                 from_tf=bool(".ckpt" in self.model_name),
-                config=model_config,
+                config=copy.deepcopy(model_config),
             )
-            self.model = model
-            self.tokenizer = model_tokenizer
+            self.tokenizer = copy.deepcopy(model_tokenizer)
         elif self.classifier == "custom":
-            sys.path.append("./models")
             # Custom_model일경우 model_name.py에서 tokenizer, config도 받아와야한다.
-            model_module = getattr(
-                import_module(
-                    self.model_name), self.get_custom_class[self.model_name]
-            )
-            self.model = model_module()
+            self.model = self.get_custom_class[self.model_name]()
             self.tokenizer = self.model.get_tokenizer()
         else:
             print("잘못된 이름 또는 없는 모델입니다.")
+            return
+        self.check_cls_position()
+        # padding side는 model마다 고정이므로 feature 생성 시 매번 분기하지 않도록 한 번만 계산합니다.
+        self._pad_on_right = self.tokenizer.padding_side == "right"
+
+    def check_cls_position(self) -> NoReturn:
+        # train feature는 정답이 없는 span의 label을 0번째 token(cls)으로 고정하므로
+        # tokenizer가 (question, context) pair의 맨 앞에 cls token을 두는지 확인합니다.
+        input_ids = self.tokenizer("question", "context")["input_ids"]
+        if input_ids[0] != self.tokenizer.cls_token_id:
+            raise ValueError(
+                f"{self.tokenizer.__class__.__name__} does not place cls token at position 0"
+            )
 
     def get_model_tokenizer(self) -> (AutoModelForQuestionAnswering, AutoTokenizer):
         return self.model, self.tokenizer
@@ -117,171 +359,125 @@ class Reader:
             "answers" if "answers" in self.column_names else self.column_names[2]
         )
 
+        # (question|context) 혹은 (context|question) 순서와 truncation 방향을 padding side에 맞춰 미리 정합니다.
+        if self._pad_on_right:
+            self._first_column_name = self.question_column_name
+            self._second_column_name = self.context_column_name
+            self._truncation = "only_second"
+            self._context_index = 1
+        else:
+            self._first_column_name = self.context_column_name
+            self._second_column_name = self.question_column_name
+            self._truncation = "only_first"
+            self._context_index = 0
+
     def set_max_seq_length(self, max_seq_length: int) -> NoReturn:
         self.max_seq_length = max_seq_length
 
-    def prepare_train_features(self, examples: Dataset):
-        # Train preprocessing / 전처리를 진행하는 함수.
-        # truncation과 padding(length가 짧을때만)을 통해 toknization을 진행하며, stride를 이용하여 overflow를 유지합니다.
-        # 각 example들은 이전의 context와 조금씩 겹치게됩니다.
-        tokenizer = self.tokenizer
-        data_args = self.data_args
-
-        # Padding에 대한 옵션을 설정합니다.
-        # (question|context) 혹은 (context|question)로 세팅 가능합니다.
-        pad_on_right = tokenizer.padding_side == "right"
-
-        tokenized_examples = tokenizer(
-            examples[
-                self.question_column_name if pad_on_right else self.context_column_name
-            ],
-            examples[
-                self.context_column_name if pad_on_right else self.question_column_name
-            ],
-            truncation="only_second" if pad_on_right else "only_first",
-            max_length=self.max_seq_length,
-            stride=data_args.doc_stride,
-            return_overflowing_tokens=True,
-            return_offsets_mapping=True,
-            # return_token_type_ids=False, # roberta모델을 사용할 경우 False, bert를 사용할 경우 True로 표기해야합니다.
-            padding="max_length" if data_args.pad_to_max_length else False,
+    def get_tokenize_kwargs(self) -> dict:
+        # train/validation feature 생성 함수가 공통으로 받는 tokenize 설정
+        return {
+            "first_column_name": self._first_column_name,
+            "second_column_name": self._second_column_name,
+            "truncation": self._truncation,
+            "context_index": self._context_index,
+            "max_seq_length": self.max_seq_length,
+            "doc_stride": self.data_args.doc_stride,
+        }
+
+    def get_map_kwargs(self) -> dict:
+        # train/validation feature 생성 map이 공통으로 사용하는 설정
+        # 큰 batch로 tokenizer 호출 횟수를 줄이고, fork된 process에서는 rust tokenizer의 병렬화가
+        # 꺼지므로 단일 process로 처리합니다.
+        return {
+            "batched": True,
+            "batch_size": 4096,
+            "writer_batch_size": 4096,
+            "num_proc": 1,
+            "load_from_cache_file": not self.data_args.overwrite_cache,
+        }
+
+    def get_tokenizer_pool(self) -> List[AutoTokenizer]:
+        # shard마다 별도의 tokenizer를 사용해 rust tokenizer 내부 상태의 lock 경합을 피합니다.
+        # train feature 생성에만 필요하므로 get_train_dataset에서 호출할 때 만듭니다.
+        # deepcopy는 rust tokenizer를 직렬화 후 다시 만들므로, map 동안 쓰이지 않는 self.tokenizer를
+        # 첫 번째 shard에 그대로 사용해 복사 횟수를 줄입니다.
+        return [self.tokenizer] + [
+            copy.deepcopy(self.tokenizer) for _ in range(self.tokenizer_pool_size - 1)
+        ]
+
+    def get_train_features(self) -> Features:
+        # train feature의 Arrow schema를 작은 정수형으로 고정합니다.
+        # 지정하지 않으면 start/end position이 int64로 추론되어 cache와 메모리를 더 차지합니다.
+        # vocab이 int16 범위에 들어가면 input_ids도 int16으로 저장합니다.
+        # data collator의 tokenizer.pad가 batch를 python int로 바꾼 뒤 다시 tensor로 만들므로 model에는 int64로 들어갑니다.
+        input_ids_dtype = "int16" if len(self.tokenizer) <= 2 ** 15 else "int32"
+        features = {"input_ids": Sequence(Value(input_ids_dtype))}
+        if "token_type_ids" in self.tokenizer.model_input_names:
+            features["token_type_ids"] = Sequence(Value("int8"))
+        # max_seq_length는 int16 범위를 넘지 않습니다.
+        features["start_positions"] = Value("int16")
+        features["end_positions"] = Value("int16")
+        features["_orig_idx"] = Value("int64")
+        return Features(features)
+
+    def sort_by_length(self, dataset: Dataset) -> Dataset:
+        # 원래 순서를 "_orig_idx"에 저장한 뒤 (question + context) 길이 순으로 정렬합니다.
+        # 비슷한 길이의 example끼리 같은 batch로 tokenize되어 span 수와 padding 편차가 줄어듭니다.
+        dataset = dataset.map(
+            functools.partial(
+                add_length_columns,
+                question_column_name=self.question_column_name,
+                context_column_name=self.context_column_name,
+            ),
+            batched=True,
+            with_indices=True,
+            load_from_cache_file=not self.data_args.overwrite_cache,
         )
+        return dataset.sort("context_len", kind="stable")
 
-        # 길이가 긴 context가 등장할 경우 truncate를 진행해야하므로, 해당 데이터셋을 찾을 수 있도록 mapping 가능한 값이 필요합니다.
-        sample_mapping = tokenized_examples.pop("overflow_to_sample_mapping")
-        # token의 캐릭터 단위 position를 찾을 수 있도록 offset mapping을 사용합니다.
-        # start_positions과 end_positions을 찾는데 도움을 줄 수 있습니다.
-        offset_mapping = tokenized_examples.pop("offset_mapping")
-
-        # 데이터셋에 "start position", "enc position" label을 부여합니다.
-        tokenized_examples["start_positions"] = []
-        tokenized_examples["end_positions"] = []
-
-        for i, offsets in enumerate(offset_mapping):
-            input_ids = tokenized_examples["input_ids"][i]
-            cls_index = input_ids.index(tokenizer.cls_token_id)  # cls index
-
-            # sequence id를 설정합니다 (to know what is the context and what is the question).
-            sequence_ids = tokenized_examples.sequence_ids(i)
-
-            # 하나의 example이 여러개의 span을 가질 수 있습니다.
-            sample_index = sample_mapping[i]
-            answers = examples[self.answer_column_name][sample_index]
-
-            # answer가 없을 경우 cls_index를 answer로 설정합니다(== example에서 정답이 없는 경우 존재할 수 있음).
-            if len(answers["answer_start"]) == 0:
-                tokenized_examples["start_positions"].append(cls_index)
-                tokenized_examples["end_positions"].append(cls_index)
-            else:
-                # text에서 정답의 Start/end character index
-                start_char = answers["answer_start"][0]
-                end_char = start_char + len(answers["text"][0])
-
-                # text에서 current span의 Start token index
-                token_start_index = 0
-                while sequence_ids[token_start_index] != (1 if pad_on_right else 0):
-                    token_start_index += 1
-
-                # text에서 current span의 End token index
-                token_end_index = len(input_ids) - 1
-                while sequence_ids[token_end_index] != (1 if pad_on_right else 0):
-                    token_end_index -= 1
-
-                # 정답이 span을 벗어났는지 확인합니다(정답이 없는 경우 CLS index로 label되어있음).
-                if not (
-                    offsets[token_start_index][0] <= start_char
-                    and offsets[token_end_index][1] >= end_char
-                ):
-                    tokenized_examples["start_positions"].append(cls_index)
-                    tokenized_examples["end_positions"].append(cls_index)
-                else:
-                    # token_start_index 및 token_end_index를 answer의 끝으로 이동합니다.
-                    # Note: answer가 마지막 단어인 경우 last offset을 따라갈 수 있습니다(edge case).
-                    while (
-                        token_start_index < len(offsets)
-                        and offsets[token_start_index][0] <= start_char
-                    ):
-                        token_start_index += 1
-                    tokenized_examples["start_positions"].append(
-                        token_start_index - 1)
-                    while offsets[token_end_index][1] >= end_char:
-                        token_end_index -= 1
-                    tokenized_examples["end_positions"].append(
-                        token_end_index + 1)
-
-        return tokenized_examples
+    def restore_order(self, features: Dataset) -> Dataset:
+        # feature를 원래 example 순서로 되돌립니다. 같은 example의 span 순서는 stable sort로 유지됩니다.
+        features = features.sort("_orig_idx", kind="stable")
+        return features.remove_columns(["_orig_idx"])
 
     def get_train_dataset(self) -> Dataset:
-        train_dataset = self.datasets["train"]
+        train_dataset = self.sort_by_length(self.datasets["train"])
 
         train_dataset = train_dataset.map(
-            self.prepare_train_features,
-            batched=True,
-            num_proc=self.data_args.preprocessing_num_workers,
-            remove_columns=self.column_names,
-            load_from_cache_file=not self.data_args.overwrite_cache,
+            functools.partial(
+                prepare_train_features_sharded,
+                tokenizer_pool=self.get_tokenizer_pool(),
+                context_column_name=self.context_column_name,
+                answer_column_name=self.answer_column_name,
+                **self.get_tokenize_kwargs(),
+            ),
+            **self.get_map_kwargs(),
+            remove_columns=train_dataset.column_names,
+            keep_in_memory=self.data_args.keep_in_memory,
+            features=self.get_train_features(),
         )
+        train_dataset = self.restore_order(train_dataset)
+        # Arrow에서 읽을 때 numpy를 거쳐 torch tensor로 바로 만들어 dataset 단계의 python list 변환을 줄입니다.
+        # (data collator의 tokenizer.pad는 padding을 위해 여전히 python list로 변환합니다.)
+        # validation feature는 후처리에서 offset_mapping과 example_id를 python 객체로 사용하므로 그대로 둡니다.
+        train_dataset.set_format(type="torch", columns=train_dataset.column_names)
         return train_dataset
 
-    def prepare_validation_features(self, examples: Dataset):
-        # truncation과 padding(length가 짧을때만)을 통해 toknization을 진행하며, stride를 이용하여 overflow를 유지합니다.
-        # 각 example들은 이전의 context와 조금씩 겹치게됩니다.
-        tokenizer = self.tokenizer
-        pad_on_right = tokenizer.padding_side == "right"
-
-        tokenized_examples = tokenizer(
-            examples[
-                self.question_column_name if pad_on_right else self.context_column_name
-            ],
-            examples[
-                self.context_column_name if pad_on_right else self.question_column_name
-            ],
-            truncation="only_second" if pad_on_right else "only_first",
-            max_length=self.max_seq_length,
-            stride=self.data_args.doc_stride,
-            return_overflowing_tokens=True,
-            return_offsets_mapping=True,
-            # return_token_type_ids=False, # roberta모델을 사용할 경우 False, bert를 사용할 경우 True로 표기해야합니다.
-            padding="max_length" if self.data_args.pad_to_max_length else False,
-        )
-
-        # 길이가 긴 context가 등장할 경우 truncate를 진행해야하므로, 해당 데이터셋을 찾을 수 있도록 mapping 가능한 값이 필요합니다.
-        sample_mapping = tokenized_examples.pop("overflow_to_sample_mapping")
-
-        # evaluation을 위해, prediction을 context의 substring으로 변환해야합니다.
-        # corresponding example_id를 유지하고 offset mappings을 저장해야합니다.
-        tokenized_examples["example_id"] = []
-
-        for i in range(len(tokenized_examples["input_ids"])):
-            # sequence id를 설정합니다 (to know what is the context and what is the question).
-            sequence_ids = tokenized_examples.sequence_ids(i)
-            context_index = 1 if pad_on_right else 0
-
-            # 하나의 example이 여러개의 span을 가질 수 있습니다.
-            sample_index = sample_mapping[i]
-            tokenized_examples["example_id"].append(
-                examples["id"][sample_index])
-
-            # Set to None the offset_mapping을 None으로 설정해서 token position이 context의 일부인지 쉽게 판별 할 수 있습니다.
-            tokenized_examples["offset_mapping"][i] = [
-                (o if sequence_ids[k] == context_index else None)
-                for k, o in enumerate(tokenized_examples["offset_mapping"][i])
-            ]
-
-        return tokenized_examples
-
     def get_validation_dataset(self) -> Dataset:
-        eval_dataset = self.datasets["validation"]
+        eval_dataset = self.sort_by_length(self.datasets["validation"])
 
         # Validation Feature 생성
         eval_dataset = eval_dataset.map(
-            self.prepare_validation_features,
-            batched=True,
-            num_proc=self.data_args.preprocessing_num_workers,
-            remove_columns=self.column_names,
-            load_from_cache_file=not self.data_args.overwrite_cache,
+            functools.partial(
+                prepare_validation_features,
+                tokenizer=self.tokenizer,
+                **self.get_tokenize_kwargs(),
+            ),
+            **self.get_map_kwargs(),
+            remove_columns=eval_dataset.column_names,
         )
-        return eval_dataset
+        return self.restore_order(eval_dataset)
 
 
 if __name__ == "__main__":
@@ -50,6 +50,8 @@ def main():
         eval_steps=trainer_args.eval_steps,
         load_best_model_at_end=True,
         metric_for_best_model="eval_exact_match",
+        # 비슷한 길이의 feature끼리 batch를 구성해 data collator의 padding을 줄입니다.
+        group_by_length=trainer_args.group_by_length,
     )
     print(model_args.model_name_or_path)
 
@@ -128,11 +130,9 @@ def run_mrc(
         eval_dataset = reader.get_validation_dataset()
 
     # Data collator
-    # flag가 True이면 이미 max length로 padding된 상태입니다.
-    # 그렇지 않다면 data collator에서 padding을 진행해야합니다.
-    data_collator = DataCollatorWithPadding(
-        tokenizer, pad_to_multiple_of=8 if training_args.fp16 else None
-    )
+    # feature는 padding 없이 저장되므로 data collator에서 batch 단위로 padding을 진행합니다.
+    # pad_to_multiple_of=8로 fp16 tensor core 정렬을 맞춥니다.
+    data_collator = DataCollatorWithPadding(tokenizer, pad_to_multiple_of=8)
 
     # Trainer 초기화
     trainer = QuestionAnsweringTrainer(
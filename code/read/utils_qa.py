@@ -172,6 +172,14 @@ def set_seed(seed: int = 42) -> NoReturn:
         torch.backends.cudnn.benchmark = False
 
 
+def is_context_offset(offset) -> bool:
+    """
+    feature의 offset이 context token의 offset인지 확인합니다.
+    context가 아닌 token의 offset은 None 혹은 (-1, -1)로 표시됩니다.
+    """
+    return offset is not None and offset[0] >= 0
+
+
 def postprocess_qa_predictions(
     examples,
     features,
@@ -288,8 +296,8 @@ def postprocess_qa_predictions(
                     if (
                         start_index >= len(offset_mapping)
                         or end_index >= len(offset_mapping)
-                        or offset_mapping[start_index] is None
-                        or offset_mapping[end_index] is None
+                        or not is_context_offset(offset_mapping[start_index])
+                        or not is_context_offset(offset_mapping[end_index])
                     ):
                         continue
                     # 길이가 < 0 또는 > max_answer_length인 answer도 고려하지 않습니다.